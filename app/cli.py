@@ -1,125 +1,198 @@
+import sys
+from typing import List, Optional
 from typing_extensions import Annotated     # for adding help arguments to the respective cli command functions
-import typer
-from app.database import create_db_and_tables, get_session, drop_all
-from app.models import User
-from fastapi import Depends
-from sqlmodel import select
-from sqlalchemy.exc import IntegrityError
+import typer                                # only typer is imported up front; database modules are imported inside each command to keep startup (and --help) fast
 
 cli = typer.Typer()
 
+def _db(ctx: typer.Context):        # returns the database session shared by the whole invocation, opening it on first use
+    root = ctx.find_root()
+    if root.obj is None:
+        from app.database import get_session
+        root.obj = root.with_resource(get_session())    # gets a connection to the database, closed automatically when the cli exits
+    return root.obj
+
 @cli.command(help = "Initializes the database and creates a default user 'bob'")
-def initialize():                   # initializes the database with a default user "bob"
-    with get_session() as db:       # gets a connection to the database
-        drop_all()                  # deletes all tables
-        create_db_and_tables()      # recreates all tables
-        bob = User('bob', 'bob@mail.com', 'bobpass')    # creates a new user (in memory)
-        db.add(bob)                 # tells the database about this new data
-        db.commit()                 # tells the database persist the data
-        db.refresh(bob)             # updates the user (we use this to get the ID from the db)
-        print("Database Initialized")
+def initialize(ctx: typer.Context):                   # initializes the database with a default user "bob"
+    from app.database import create_db_and_tables, drop_all
+    from app.models import User
+    db = _db(ctx)                   # gets the database session opened for this invocation
+    drop_all()                  # deletes all tables
+    create_db_and_tables()      # recreates all tables
+    bob = User('bob', 'bob@mail.com', 'bobpass')    # creates a new user (in memory)
+    db.add(bob)                 # tells the database about this new data
+    db.commit()                 # tells the database persist the data
+    print("Database Initialized")
 
 
 # TASK 5.1
 @cli.command(help = "Retrieves and prints a user by the given username from the database")
 # def get_user(username:str):       # retrieves and prints a user by a given username from the database
-def get_user(username: Annotated[str, typer.Argument(help = "Username of the user to search for in the database")]):
-    with get_session() as db:       # gets a connection to the database
-        user = db.exec(select(User).where(User.username == username)).first()   # searches the database for the user by the given username
-        if not user:                # if the user is not found
-            print(f'{username} not found!')     # prints a message
-            return                  # exits the function
-        print(user)                 # else the user details are printed when found
+def get_user(ctx: typer.Context, username: Annotated[str, typer.Argument(help = "Username of the user to search for in the database")]):
+    from app.models import User
+    from sqlmodel import select
+    db = _db(ctx)                   # gets the database session opened for this invocation
+    user = db.exec(select(User).where(User.username == username)).first()   # searches the database for the user by the given username
+    if not user:                # if the user is not found
+        print(f'{username} not found!')     # prints a message
+        return                  # exits the function
+    print(user)                 # else the user details are printed when found
+
+
+@cli.command(help = "Retrieves and prints several users by the given usernames from the database in a single query")
+# def get_users(usernames: List[str]):  # retrieves and prints users by a list of usernames from the database
+def get_users(ctx: typer.Context, usernames: Annotated[List[str], typer.Argument(help = "Usernames of the users to search for in the database")]):
+    from app.models import User
+    from sqlmodel import select
+    db = _db(ctx)                   # gets the database session opened for this invocation
+    # searches the database for all the given usernames at once (WHERE username IN (...)) instead of one query per username
+    found = {user.username: user for user in db.exec(select(User).where(User.username.in_(usernames)))}
+    for username in usernames:  # iterates through the usernames in the order they were given
+        if username in found:
+            print(found[username])          # prints the user details when found
+        else:
+            print(f'{username} not found!') # else prints a message
 
 
 # TASK 5.2
 @cli.command(help = "Retrieves and prints all users from the database")
-def get_all_users():                # retrieves and prints all users from the database
-    with get_session() as db:       # gets a connection to the database
-        all_users = db.exec(select(User)).all()     # retrieves all users from the database
-        if not all_users:           # if no users are found
-            print('No users found!')    # prints a message
-            return                  # exits the function
-        else:
-            for user in all_users:  # else it iterates through all users in the database
-                print(user)         # and prints each user's details
+def get_all_users(ctx: typer.Context):                # retrieves and prints all users from the database
+    from app.models import User
+    from sqlmodel import select
+    db = _db(ctx)                   # gets the database session opened for this invocation
+    # streams the users from the database in batches of 500 rather than loading them all into a list first
+    all_users = db.exec(select(User).execution_options(yield_per=500))
+    count = 0                   # counts how many users were printed
+    for batch in all_users.partitions():    # iterates through the users in the database one batch at a time
+        sys.stdout.write(''.join(f'{user}\n' for user in batch))    # and writes each batch of user details in a single call
+        count += len(batch)
+    if count == 0:              # if no users are found
+        print('No users found!')    # prints a message
 
 
 # TASK 6 
 @cli.command(help = "Updates a user's email by the given username")
 # def change_email(username: str, new_email:str):   # updates a user's email by a given username
-def change_email(username: Annotated[str, typer.Argument(help = "The username of the user whose email is to be updated")],                 
+def change_email(ctx: typer.Context, username: Annotated[str, typer.Argument(help = "The username of the user whose email is to be updated")],                 
                  new_email: Annotated[str, typer.Argument(help = "The new email address to update for the user")]):
-    with get_session() as db:                       # gets a connection to the database
-        user = db.exec(select(User).where(User.username == username)).first()       # searches the database for the user by the given username
-        if not user:                                # if the user is not found  
-            print(f'{username} not found! Unable to update email.')     # prints a message
-            return                                  # exits the function
-        user.email = new_email                      # else the user's email is to be updated
-        db.add(user)                                # updates the database with the new email
-        db.commit()                                 # changes are committed to the database 
-        print(f"Updated {user.username}'s email to {user.email}")   # prints a confirmation message
+    from app.models import User
+    from sqlmodel import update
+    db = _db(ctx)                                   # gets the database session opened for this invocation
+    # updates the user's email by the given username in a single UPDATE statement, without selecting the user first
+    result = db.exec(update(User).where(User.username == username).values(email=new_email))
+    db.commit()                                 # changes are committed to the database 
+    if result.rowcount == 0:                    # if no row was updated, the user was not found
+        print(f'{username} not found! Unable to update email.')     # prints a message
+        return                                  # exits the function
+    print(f"Updated {username}'s email to {new_email}")     # else prints a confirmation message
 
 
 # TASK 7
 @cli.command(help = "Creates a new user with the given username, email, and password and adds details to the database")
-def create_user(username: Annotated[str, typer.Argument(help = "The username of the new user to be created")], 
+def create_user(ctx: typer.Context, username: Annotated[str, typer.Argument(help = "The username of the new user to be created")], 
                 email: Annotated[str, typer.Argument(help = "The email address of the new user to be created")], 
                 password: Annotated[str, typer.Argument(help = "The password of the new user to be created")]):   
     # creates a new user with the given username, email, and password
-    with get_session() as db:       # gets a connection to the database
-        newuser = User(username, email, password)           # creates a new user object in memory
-        try:                        # tries to add the new user to the database
-            db.add(newuser)         # updates the database with the new user details
-            db.commit()             # changes are committed to the database
-        except IntegrityError as e: # catches the error if the username or email already exists in the database
-            db.rollback()                   # lets the database undo any previous steps of a transaction
-            print(e.orig)                   # optionally prints the error raised by the database
-            print("Username or email already taken!")       # prints an error message
-        else:
-            print(newuser)          # else prints the new user's details if successfully created
+    from app.models import User
+    from sqlalchemy.exc import IntegrityError
+    db = _db(ctx)                   # gets the database session opened for this invocation
+    newuser = User(username, email, password)           # creates a new user object in memory
+    try:                        # tries to add the new user to the database
+        db.add(newuser)         # updates the database with the new user details
+        db.commit()             # changes are committed to the database
+    except IntegrityError as e: # catches the error if the username or email already exists in the database
+        db.rollback()                   # lets the database undo any previous steps of a transaction
+        print(e.orig)                   # optionally prints the error raised by the database
+        print("Username or email already taken!")       # prints an error message
+    else:
+        print(newuser)          # else prints the new user's details if successfully created
+
+
+@cli.command(help = "Creates several users from a CSV file of username,email,password lines and adds them to the database in one transaction")
+def create_users(ctx: typer.Context, file: Annotated[typer.FileText, typer.Argument(help = "CSV file (or - for stdin) with one username,email,password per line; a username,email,password header line is skipped")]):
+    # creates new users from each line of the given file
+    import csv
+    from app.models import User
+    from sqlalchemy.exc import IntegrityError
+    db = _db(ctx)                   # gets the database session opened for this invocation
+    newusers = []
+    for line, row in enumerate(csv.reader(file), start=1):  # iterates through every line of the file
+        if not row:                 # skips empty lines
+            continue
+        if len(row) != 3:           # if the line is not username,email,password, prints an error message and exits without creating any users
+            print(f'Line {line} must be username,email,password! No users were created.')
+            return
+        username, email, password = (field.strip() for field in row)
+        if line == 1 and (username, email, password) == ('username', 'email', 'password'):    # skips the header line if the file has one
+            continue
+        if not (username and email and password):   # if any field is empty, prints an error message and exits without creating any users
+            print(f'Line {line} has an empty username, email or password! No users were created.')
+            return
+        newusers.append(User(username, email, password))    # creates a new user object in memory
+    try:                        # tries to add all the new users to the database
+        db.add_all(newusers)    # updates the database with all the new user details
+        db.commit()             # changes are committed to the database once for the whole batch
+    except IntegrityError as e: # catches the error if any username or email already exists in the database
+        db.rollback()                   # lets the database undo the whole batch
+        print(e.orig)                   # optionally prints the error raised by the database
+        print("Username or email already taken! No users were created.")   # prints an error message
+    else:
+        print(f'Created {len(newusers)} users')     # else prints how many users were successfully created
 
 
 # TASK 8
 @cli.command(help = "Deletes a user by the given username from the database")
 # def delete_user(username: str):       # deletes a user by a given username
-def delete_user(username: Annotated[str, typer.Argument(help = "The username of the user to be deleted from the database")]):
-    with get_session() as db:           # gets a connection to the database
-        user = db.exec(select(User).where(User.username == username)).first()       # searches the database for the user by the given username
-        if not user:                    # if the user is not found, prints an error message and exits the function
-            print(f'{username} not found! Unable to delete user.')
-            return
-        db.delete(user)                 # else the user is deleted from the database
-        db.commit()                     # changes are committed to the database
-        print(f'User {username} deleted successfully.')     # prints a confirmation message
+def delete_user(ctx: typer.Context, username: Annotated[str, typer.Argument(help = "The username of the user to be deleted from the database")]):
+    from app.models import User
+    from sqlmodel import delete
+    db = _db(ctx)                       # gets the database session opened for this invocation
+    # deletes the user by the given username in a single DELETE statement, without selecting the user first
+    result = db.exec(delete(User).where(User.username == username))
+    db.commit()                     # changes are committed to the database
+    if result.rowcount == 0:        # if no row was deleted, the user was not found, so prints an error message and exits the function
+        print(f'{username} not found! Unable to delete user.')
+        return
+    print(f'User {username} deleted successfully.')     # prints a confirmation message
 
 
 # EXERCISE 1
 @cli.command(help = "Finds and prints users whose username or email contains the given partial string")
 # def find_user_partial(partial: str):
-def find_user_partial(partial: Annotated[str, typer.Argument(help = "The partial string to search for in usernames and emails in the database")]):
-    with get_session() as db:           # gets a connection to the database
-        # searches the database for users whose username or email contains the given partial string
-        users = db.exec(select(User).where((User.username.contains(partial)) | (User.email.contains(partial)) )).all()
-        if not users:                   # if no users are found matching the partial string
-            print(f'No users found matching "{partial}"')       # prints an error message
-            return                      # exits the function
-        for user in users:              # else it iterates through all matching users and prints each user details from the database
-            print(user)
+def find_user_partial(ctx: typer.Context, partial: Annotated[str, typer.Argument(help = "The partial string to search for in usernames and emails in the database")]):
+    from app.models import User
+    from sqlmodel import select
+    db = _db(ctx)                       # gets the database session opened for this invocation
+    # searches the database for users whose username or email contains the given partial string
+    users = db.exec(select(User).where((User.username.contains(partial)) | (User.email.contains(partial)) )).all()
+    if not users:                   # if no users are found matching the partial string
+        print(f'No users found matching "{partial}"')       # prints an error message
+        return                      # exits the function
+    sys.stdout.write(''.join(f'{user}\n' for user in users))    # else writes all matching user details from the database in a single call
 
 
 # EXERCISE 2
-@cli.command(help = "Lists users from the database by a paginated table using limit and offset values")
-# def list_users(limit: int = 10, offset: int = 0):
-def list_users(limit: Annotated[int, typer.Argument(help = "The maximum number of users to retrieve from the database", min=1)] = 10, 
-               offset: Annotated[int, typer.Argument(help = "The number of users to skip before starting to collect the result set", min=0)] = 0):
-    with get_session() as db:           # gets a connection to the database
-        users = db.exec(select(User).offset(offset).limit(limit)).all()         # applies offset and limit in order to paginate the results
-        if not users:                   # if no users are found in the specified range
-            print('No users found!')    # prints an error message and exits the function
-            return
-        for user in users:              # else it iterates through all retrieved users from the database and prints each user details from the database
-            print(user)
+@cli.command(help = "Lists users from the database by a paginated table using limit and after_id (keyset cursor) values. The old positional offset argument has been replaced by --after-id; --offset is kept only as a deprecated fallback")
+# def list_users(limit: int = 10, after_id: int = 0):   # after_id is an option so the old positional offset call (list-users 10 20) fails instead of returning different rows
+def list_users(ctx: typer.Context, limit: Annotated[int, typer.Argument(help = "The maximum number of users to retrieve from the database", min=1)] = 10, 
+               after_id: Annotated[int, typer.Option(help = "The cursor to page from: only users with an id greater than this are listed", min=0)] = 0,
+               offset: Annotated[Optional[int], typer.Option(help = "Deprecated, use --after-id instead: the number of users to skip before starting to collect the result set", min=0)] = None):
+    from app.models import User
+    from sqlmodel import select
+    db = _db(ctx)                       # gets the database session opened for this invocation
+    # seeks past the cursor on the primary key index instead of scanning and skipping rows with an offset
+    statement = select(User).where(User.id > after_id).order_by(User.id).limit(limit)
+    if offset is not None:          # falls back to the old offset pagination, warning that it is deprecated
+        print('Warning: --offset is deprecated and will be removed, use --after-id with the printed next cursor instead.', file=sys.stderr)
+        statement = statement.offset(offset)
+    users = db.exec(statement).all()
+    if not users:                   # if no users are found after the given cursor
+        print('No users found!')    # prints an error message and exits the function
+        return
+    for user in users:              # else it iterates through all retrieved users from the database and prints each user details from the database
+        print(user)
+    if len(users) == limit:         # if the page is full there may be more users, so prints the id of the last user to request the next page with --after-id
+        print(f'next cursor: {user.id}')
 
 
 # EXERCISE 3
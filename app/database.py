@@ -9,6 +9,7 @@ sqlite_file_name = "database.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 
 connect_args = {"check_same_thread": False}
+# the engine (and its connection pool, a QueuePool by default for a SQLite file) is created once at import time so every session reuses pooled connections
 engine = create_engine(sqlite_url, connect_args=connect_args)
 
 def create_db_and_tables():
@@ -1,4 +1,5 @@
 from sqlmodel import Field, SQLModel
+from sqlalchemy import DDL, Index, event
 from typing import Optional
 from pwdlib import PasswordHash
 
@@ -10,6 +11,12 @@ class User(SQLModel, table=True):
     email:str = Field(index=True, unique=True)
     password:str
 
+    # trigram GIN indexes so LIKE '%partial%' searches (find_user_partial) can use an index; only created on PostgreSQL
+    __table_args__ = (
+        Index('ix_user_username_trgm', 'username', postgresql_using='gin', postgresql_ops={'username': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        Index('ix_user_email_trgm', 'email', postgresql_using='gin', postgresql_ops={'email': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
+
     def __init__(self, username, email, password):
         self.username = username
         self.email = email  
@@ -19,4 +26,8 @@ class User(SQLModel, table=True):
         self.password = password_hash.hash(password)
 
     def __str__(self) -> str:
-        return f"(User id={self.id}, username={self.username}, email={self.email})"
\ No newline at end of file
+        return f"(User id={self.id}, username={self.username}, email={self.email})"
+
+
+# the trigram operator classes used by the indexes above come from the pg_trgm extension
+event.listen(User.__table__, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
\ No newline at end of file